@@ -1,31 +1,28 @@
-def recover_abundance_from_vectors(A, y, w):
+import numpy as np
+import scipy.sparse as sp
+from scipy.optimize import linprog
+
+
+def recover_abundance_from_vectors(A, y, w, method='highs'):
     """
     Runs the linear program for quantile regression with weight w on the equation Ax = y.
     :param A: matrix (reference database)
     :param y: vector (sample kmer counts)
     :param w: False positive weight
+    :param method: HiGHS algorithm passed to linprog ('highs', 'highs-ds' for dual simplex, 'highs-ipm' for
+    interior point)
     :return: vector x (estimated organism counts)
     """
     K, N = np.shape(A)
-    x = cp.Variable(N)
-    u = cp.Variable(K)
-    v = cp.Variable(K)
     tau = 1 / (w + 1)
-    ones_K = np.ones(K)
-    objective = cp.Minimize(
-        tau * (ones_K @ u) + (1 - tau) * (ones_K @ v)
-    )
-    constraints = [
-        x >= 0,
-        u >= 0,
-        v >= 0,
-        u - v + (A @ x) == y,
-    ]
-    prob = cp.Problem(objective, constraints)
-    result = prob.solve(solver=cp.SCIPY, verbose=False)
-    recov_y = A @ x.value
-    resid = y - (A @ x.value)
-    return x.value, resid
+    # stack the variables as z = [x; u; v] and pass the LP straight to HiGHS (skips the CVXPY canonicalization):
+    # minimize tau * 1^T u + (1 - tau) * 1^T v  s.t.  A x + u - v = y,  x, u, v >= 0
+    c = np.concatenate([np.zeros(N), tau * np.ones(K), (1 - tau) * np.ones(K)])
+    A_eq = sp.hstack([sp.csr_matrix(A), sp.eye(K), -sp.eye(K)], format='csr')
+    result = linprog(c, A_eq=A_eq, b_eq=y, bounds=[(0, None)] * (N + 2 * K), method=method)
+    x = result.x[:N]
+    resid = y - (A @ x)
+    return x, resid
 
 
 import numpy as np
@@ -3,7 +3,6 @@ import sys
 import sourmash
 import argparse
 from pathlib import Path
-from scipy.sparse import save_npz
 import srcs.utils as utils
 from loguru import logger
 import json
@@ -47,11 +46,11 @@ if __name__ == "__main__":
     # remove 'same' organisms: any organisms with ANI > ani_thresh are considered the same organism
     logger.info("Removing 'same' organisms with ANI > ani_thresh")
     processed_ref_matrix, uncorr_org_idx = utils.get_uncorr_ref(ref_matrix, ksize, ani_thresh)
-    save_npz(f'{out_prefix}_ref_matrix_processed.npz', processed_ref_matrix)
+    utils.write_ref_matrix(f'{out_prefix}_ref_matrix_processed', processed_ref_matrix)
 
     # write out hash-to-row-indices file
     logger.info("Writing out hash-to-row-indices file")
-    utils.write_hashes(f'{out_prefix}_hash_to_col_idx.pkl', hashes)
+    utils.write_hashes(f'{out_prefix}_hash_to_col_idx', hashes)
 
     # write out organism manifest (original index, processed index, num unique kmers, num total kmers, scale factor)
     logger.info("Writing out organism manifest")
@@ -59,8 +58,9 @@ if __name__ == "__main__":
 
     # save the k-mer size and ani threshold to a json file
     logger.info("Saving k-mer size and ani threshold to json file")
-    json.dump({'reference_matrix_path': str(Path(f'{out_prefix}_ref_matrix_processed.npz').resolve()),
-               'hash_to_idx_path': str(Path(f'{out_prefix}_hash_to_col_idx.pkl').resolve()),
-               'processed_org_file_path': str(Path(f'{out_prefix}_processed_org_idx.csv').resolve()),
-               'ksize': ksize,
-               'ani_thresh': ani_thresh}, open(f'{out_prefix}_config.json', 'w'), indent=4)
+    with open(f'{out_prefix}_config.json', 'w') as fid:
+        json.dump({'reference_matrix_path': str(Path(f'{out_prefix}_ref_matrix_processed').resolve()),
+                   'hash_to_idx_path': str(Path(f'{out_prefix}_hash_to_col_idx').resolve()),
+                   'processed_org_file_path': str(Path(f'{out_prefix}_processed_org_idx.csv').resolve()),
+                   'ksize': ksize,
+                   'ani_thresh': ani_thresh}, fid, indent=4)
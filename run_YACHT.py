@@ -1,15 +1,8 @@
 #!/usr/bin/env python
 import os, sys
-import numpy as np
-import pandas as pd
-import srcs.hypothesis_recovery_src as hr
-from scipy.sparse import load_npz
 import argparse
-import srcs.utils as utils
 import warnings
-import json
 warnings.filterwarnings("ignore")
-from tqdm import tqdm
 from loguru import logger
 logger.remove()
 logger.add(sys.stdout, format="{time:YYYY-MM-DD HH:mm:ss} - {level} - {message}", level="INFO")
@@ -30,6 +23,10 @@ if __name__ == "__main__":
                                                            '0 and 1, with 0 being the most sensitive (and least '
                                                            'precise) and 1 being the most precise (and least '
                                                            'sensitive).', required=False, default=[1, 0.5, 0.1, 0.05, 0.01])
+    parser.add_argument('--num_threads', type=int, help='Cap on the BLAS/OpenMP thread pools (sets OMP_NUM_THREADS, '
+                                                        'OPENBLAS_NUM_THREADS and MKL_NUM_THREADS). This only limits '
+                                                        'the pools, it does not parallelize YACHT. If not given, the '
+                                                        'environment is left untouched.', required=False, default=None)
     parser.add_argument('--out_filename', help='output filename', required=False, default='result.xlsx')
     parser.add_argument('--outdir', help='path to output directory', required=True)
 
@@ -41,14 +38,28 @@ if __name__ == "__main__":
     keep_raw = args.keep_raw  # Keep raw results in output file.
     show_all = args.show_all  # Show all organisms (no matter if present) in output file.
     min_coverage_list = args.min_coverage  # a list of percentages of unique k-mers covered by reads in the sample.
+    num_threads = args.num_threads  # cap on the BLAS/OpenMP thread pools (None: leave the environment alone)
     out_filename = args.out_filename  # output filename
     outdir = args.outdir  # csv destination for results
 
+    # limit the BLAS/OpenMP thread pools if asked to; this has to happen before numpy/scipy are imported
+    if num_threads is not None:
+        for var in ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']:
+            os.environ[var] = str(num_threads)
+
+    # the heavy imports are deferred until the arguments are parsed, so --help and argument errors return quickly
+    import numpy as np
+    import pandas as pd
+    import orjson
+    import srcs.hypothesis_recovery_src as hr
+    import srcs.utils as utils
+
     # check if the json file exists
     utils.check_file_existence(json_file_path, f'Config file {json_file_path} does not exist. '
                                                       f'Please run make_training_data_from_sketches.py first.')
     # load the config file, ksize, and ani_thresh
-    config = json.load(open(json_file_path, 'r'))
+    with open(json_file_path, 'rb') as fid:
+        config = orjson.loads(fid.read())
     reference_matrix_path = config['reference_matrix_path']
     hash_to_idx_path = config['hash_to_idx_path']
     processed_org_file_path = config['processed_org_file_path']
@@ -70,8 +81,8 @@ if __name__ == "__main__":
 
     # load the training data
     logger.info('Loading reference matrix, hash to index dictionary, and organism data.')
-    reference_matrix = load_npz(reference_matrix_path)
-    hash_to_idx = utils.load_hashes_to_index(hash_to_idx_path)
+    reference_matrix = utils.load_ref_matrix(reference_matrix_path)
+    hash_keys, hash_idx = utils.load_hash_arrays(hash_to_idx_path)
     organism_data = pd.read_csv(processed_org_file_path)
 
     logger.info('Loading sample signature.')
@@ -81,27 +92,27 @@ if __name__ == "__main__":
     logger.info('Computing sample vector.')
     # get the hashes in the sample signature (it's for a single sample)
     sample_hashes = sample_sig.minhash.hashes
-    sample_vector = utils.compute_sample_vector(sample_hashes, hash_to_idx)
+    sample_vector = utils.compute_sample_vector(sample_hashes, hash_keys, hash_idx)
 
     # get the number of kmers in the sample from the scaled sketch
     num_sample_kmers = utils.get_num_kmers(sample_sig, scale=False)  # TODO: might not save this for time reasons
     # get the number of unique kmers in the sample
     num_unique_sample_kmers = len(sample_hashes)
 
-    # prep the output data structure, copying over the organism data
-    recov_org_data = organism_data.copy()
-    recov_org_data['num_total_kmers_in_sample_sketch'] = num_sample_kmers  # TODO: might not save this for time reasons
-    recov_org_data['num_exclusive_kmers_in_sample_sketch'] = num_unique_sample_kmers
-    recov_org_data['sample_scale_factor'] = sample_sig.minhash.scaled
-    recov_org_data['min_coverage'] = 1
+    # prep the output data structure: the organism data plus the sample columns, built in a single copy
+    recov_org_data = organism_data.assign(
+        num_total_kmers_in_sample_sketch=num_sample_kmers,  # TODO: might not save this for time reasons
+        num_exclusive_kmers_in_sample_sketch=num_unique_sample_kmers,
+        sample_scale_factor=sample_sig.minhash.scaled,
+        min_coverage=1,
+    )
 
     # check that the sample scale factor is the same as the genome scale factor for all organisms
-    sample_diff_idx = np.where(recov_org_data['sample_scale_factor'].ne(
-        recov_org_data['genome_scale_factor']).to_list())[0].tolist()
-    sample_diffs = recov_org_data['organism_name'].iloc[sample_diff_idx]
-    if not sample_diffs.empty:
+    sample_diff_mask = recov_org_data['sample_scale_factor'].values != recov_org_data['genome_scale_factor'].values
+    if sample_diff_mask.any():
+        sample_diffs = recov_org_data['organism_name'].values[sample_diff_mask]
         raise ValueError(f'Sample scale factor does not equal genome scale factor for organism '
-                         f'{sample_diffs.iloc[0]} and {len(sample_diffs) - 1} others.')
+                         f'{sample_diffs[0]} and {len(sample_diffs) - 1} others.')
 
     # compute hypothesis recovery
     logger.info('Computing hypothesis recovery.')
@@ -109,18 +120,12 @@ if __name__ == "__main__":
         reference_matrix, sample_vector, ksize, significance=significance,
         ani_thresh=ani_thresh, min_coverage=1)
 
-    # Boolean indicating whether genome shares at least one k-mer with sample
-    recov_org_data['nontrivial_overlap'] = nontriv_flags
-
-    # for each of the columns of hyp_recovery_df, add it to the recov_org_data
-    for col in hyp_recovery_df.columns:
-        recov_org_data[col] = hyp_recovery_df[col]
-
-    # remove from recov_org_data all those with non-trivial overlap 0
-    recov_org_data = recov_org_data[recov_org_data['nontrivial_overlap'] == 1]
+    # only keep the organisms that share at least one k-mer with the sample (the rest have no test results),
+    # and attach the columns of hyp_recovery_df to them (hyp_recovery_df is indexed by organism)
+    recov_org_data = recov_org_data.iloc[np.flatnonzero(nontriv_flags)].join(hyp_recovery_df)
 
     # remove unnecessary columns
-    remove_cols = ['original_index', 'processed_index', 'nontrivial_overlap', 'alt_confidence_mut_rate', 'sample_scale_factor'] + [col for col in recov_org_data.columns if '_wo_coverage' in col]
+    remove_cols = ['original_index', 'processed_index', 'alt_confidence_mut_rate', 'sample_scale_factor'] + [col for col in recov_org_data.columns if '_wo_coverage' in col]
     recov_org_data_filtered = recov_org_data.drop(columns=remove_cols)
     recov_org_data_filtered.rename(columns={'genome_scale_factor': 'scale_factor'}, inplace=True)
 
@@ -128,21 +133,47 @@ if __name__ == "__main__":
     logger.info(f'Saving results to {outdir}.')
     if not isinstance(out_filename, str) and out_filename != '':
         out_filename = 'result.xlsx'
-    min_coverage_list = list(set(min_coverage_list))
-    min_coverage_list.sort(reverse=True)
+    min_coverage_list = sorted(dict.fromkeys(min_coverage_list), reverse=True)
+
+    # the coverage-adjusted columns are the min_coverage=1 columns scaled by min_coverage, so pull them out once
+    num_matches = recov_org_data_filtered['num_matches'].to_numpy(dtype=float)
+    acceptance_threshold = recov_org_data_filtered['acceptance_threshold_with_coverage'].to_numpy(dtype=float)
+    actual_confidence = recov_org_data_filtered['actual_confidence_with_coverage'].to_numpy(dtype=float)
+    alt_confidence_mut_rate = recov_org_data_filtered['alt_confidence_mut_rate_with_coverage'].to_numpy(dtype=float)
+    has_matches = num_matches != 0
+
+    # an organism is accepted at min_coverage iff num_matches >= min_coverage * acceptance_threshold (both non-zero),
+    # i.e. iff min_coverage <= num_matches / acceptance_threshold. Sort this largest accepted coverage once, so that
+    # for each min_coverage the candidates are found by a binary search instead of testing every organism.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        max_coverage = np.where(has_matches & (acceptance_threshold != 0), num_matches / acceptance_threshold, -np.inf)
+    by_max_coverage = np.argsort(-max_coverage, kind='stable')
+    neg_sorted_max_coverage = -max_coverage[by_max_coverage]
 
     # save the results with different min_coverage
-    with pd.ExcelWriter(os.path.join(outdir, out_filename), engine='openpyxl', mode='w') as writer:
+    with pd.ExcelWriter(os.path.join(outdir, out_filename), engine='xlsxwriter', mode='w') as writer:
         if keep_raw:
             recov_org_data_filtered.to_excel(writer, sheet_name=f'raw_result', index=False)
         for min_coverage in min_coverage_list:
-            temp_output_result = recov_org_data_filtered.copy()
-            temp_output_result['min_coverage'] = min_coverage
-            temp_output_result['acceptance_threshold_with_coverage'] = min_coverage * temp_output_result['acceptance_threshold_with_coverage']
-            temp_output_result['actual_confidence_with_coverage'] = min_coverage * temp_output_result['actual_confidence_with_coverage']
-            temp_output_result['alt_confidence_mut_rate_with_coverage'] = min_coverage * temp_output_result['alt_confidence_mut_rate_with_coverage']
-            temp_output_result['in_sample_est'] = (temp_output_result['num_matches'] >= temp_output_result['acceptance_threshold_with_coverage']) \
-                                                    & (temp_output_result['num_matches'] != 0) & (temp_output_result['acceptance_threshold_with_coverage'] != 0)
+            if show_all:
+                rows = np.arange(len(num_matches))
+            else:
+                # candidates, with some slack for rounding in the division; the exact test below decides
+                num_candidates = np.searchsorted(neg_sorted_max_coverage, -min_coverage * (1 - 1e-9), side='right')
+                rows = np.sort(by_max_coverage[:num_candidates])
+            acceptance_threshold_cov = min_coverage * acceptance_threshold[rows]
+            in_sample_est = num_matches[rows] >= acceptance_threshold_cov
+            in_sample_est &= has_matches[rows]
+            in_sample_est &= acceptance_threshold_cov != 0
             if not show_all:
-                temp_output_result = temp_output_result[temp_output_result['in_sample_est'] == True]
+                rows, acceptance_threshold_cov = rows[in_sample_est], acceptance_threshold_cov[in_sample_est]
+                in_sample_est = in_sample_est[in_sample_est]
+            # only materialize the rows that go into this sheet
+            temp_output_result = recov_org_data_filtered.iloc[rows].assign(
+                min_coverage=min_coverage,
+                acceptance_threshold_with_coverage=acceptance_threshold_cov,
+                actual_confidence_with_coverage=min_coverage * actual_confidence[rows],
+                alt_confidence_mut_rate_with_coverage=min_coverage * alt_confidence_mut_rate[rows],
+                in_sample_est=in_sample_est,
+            )
             temp_output_result.to_excel(writer, sheet_name=f'min_coverage{min_coverage}', index=False)
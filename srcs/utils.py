@@ -1,10 +1,10 @@
 import os, sys
 import numpy as np
+import pandas as pd
 import pickle
 import sourmash
 from tqdm import tqdm, trange
 import scipy as sp 
-import csv
 import zipfile
 from loguru import logger
 logger.remove()
@@ -21,6 +21,24 @@ def load_hashes_to_index(filename):
         hashes = pickle.load(fid)
     return hashes
 
+
+def load_hash_arrays(dirname):
+    """
+    Helper function that loads the hash to index mapping written by write_hashes. The arrays are memory-mapped.
+    Training data made by older versions, which pickled the mapping as a dictionary, is still loaded (and converted
+    with hash_to_idx_arrays).
+    :param dirname: string (location of the hash_to_col_idx directory, or of a legacy .pkl file)
+    :return: numpy arrays (sorted hashes, index of each of these hashes in the training dictionary)
+    """
+    if os.path.isfile(dirname) and str(dirname).endswith('.pkl'):
+        return hash_to_idx_arrays(load_hashes_to_index(dirname))
+    if not os.path.isdir(dirname):
+        raise ValueError(f'Hash to index file {dirname} is not in the format written by make_training_data_from_sketches.py. '
+                         f'Please re-run make_training_data_from_sketches.py.')
+    hash_keys = np.load(os.path.join(dirname, 'hash_keys.npy'), mmap_mode='r')
+    hash_idx = np.load(os.path.join(dirname, 'hash_idx.npy'), mmap_mode='r')
+    return hash_keys, hash_idx
+
     
 def load_signature_with_ksize(filename, ksize):
     """
@@ -64,28 +82,42 @@ def check_file_existence(file_path, error_description):
         raise ValueError(error_description)
 
 
-def compute_sample_vector(sample_hashes, hash_to_idx):
+def hash_to_idx_arrays(hash_to_idx):
+    """
+    Helper function that turns the dictionary mapping hashes to indices into a pair of arrays sorted by hash, so that
+    hashes can be looked up with a binary search instead of one dictionary lookup per hash.
+    :param hash_to_idx: dictionary mapping hashes to indices in the training dictionary
+    :return: numpy arrays (sorted hashes, index of each of these hashes in the training dictionary)
+    """
+    hash_keys = np.fromiter(hash_to_idx.keys(), dtype=np.uint64, count=len(hash_to_idx))
+    hash_idx = np.fromiter(hash_to_idx.values(), dtype=np.int64, count=len(hash_to_idx))
+    order = np.argsort(hash_keys)
+    return hash_keys[order], hash_idx[order]
+
+
+def compute_sample_vector(sample_hashes, hash_keys, hash_idx):
     """
     Helper function that computes the sample vector for a given sample signature.
     :param sample_hashes: hashes in the sample signature
-    :param hash_to_idx: dictionary mapping hashes to indices in the training dictionary
+    :param hash_keys: sorted hashes in the training dictionary (via hash_to_idx_arrays)
+    :param hash_idx: index of each of the hash_keys in the training dictionary
     :return: numpy array (sample vector)
     """
-    # total number of hashes in the training dictionary
-    hash_to_idx_keys = set(hash_to_idx.keys())
-    
-    # total number of hashes in the sample
-    sample_hashes_keys = set(sample_hashes.keys())
-    
-    # initialize the sample vector
-    sample_vector = np.zeros(len(hash_to_idx_keys))
-    
-    # get the hashes that are in both the sample and the training dictionary
-    sample_intersect_training_hashes = hash_to_idx_keys.intersection(sample_hashes_keys)
-    
-    # fill in the sample vector
-    for sh in tqdm(sample_intersect_training_hashes):
-        sample_vector[hash_to_idx[sh]] = sample_hashes[sh]
+    # hashes and their counts in the sample
+    sample_keys = np.fromiter(sample_hashes.keys(), dtype=np.uint64, count=len(sample_hashes))
+    sample_counts = np.fromiter(sample_hashes.values(), dtype=np.float32, count=len(sample_hashes))
+
+    sample_vector = np.zeros(len(hash_keys), dtype=np.float32)
+    # nothing to look up in an empty training dictionary
+    if len(hash_keys) == 0:
+        return sample_vector
+
+    # binary search for each sample hash in the training dictionary
+    pos = np.minimum(np.searchsorted(hash_keys, sample_keys), len(hash_keys) - 1)
+    in_training = hash_keys[pos] == sample_keys
+
+    # fill in the sample vector for the hashes that are in both the sample and the training dictionary
+    sample_vector[hash_idx[pos[in_training]]] = sample_counts[in_training]
 
     return sample_vector
 
@@ -190,18 +222,61 @@ def get_uncorr_ref(ref_matrix, ksize, ani_thresh):
     # Sort the remaining indices, uncorr_idx is now the indices of the organisms in the reference matrix that are uncorrelated
     uncorr_idx = np.sort(bysize[uncorr_idx_bysize])
 
-    return binary_ref[:, uncorr_idx], uncorr_idx
+    # the processed matrix is only ever used as 0/1 indicators, so store it with the narrowest dtype
+    # (the int dtype above is still needed for the intersection counts)
+    return binary_ref[:, uncorr_idx].astype(np.uint8), uncorr_idx
 
 
-def write_hashes(filename, hashes):
+def write_hashes(dirname, hashes):
     """
-    Write a csv file with the following columns: hash, index
-    :param filename: output filename
+    Write the hash to index mapping as two .npy arrays into the directory dirname: hash_keys.npy (sorted hashes) and
+    hash_idx.npy (index of each of these hashes), see hash_to_idx_arrays.
+    :param dirname: output directory
     :param hashes: dictionary mapping hash to index
     :return: None
     """
-    with open(filename, 'wb') as fid:
-        pickle.dump(hashes, fid)
+    hash_keys, hash_idx = hash_to_idx_arrays(hashes)
+    os.makedirs(dirname, exist_ok=True)
+    np.save(os.path.join(dirname, 'hash_keys.npy'), hash_keys)
+    np.save(os.path.join(dirname, 'hash_idx.npy'), hash_idx)
+
+
+def write_ref_matrix(dirname, ref_matrix):
+    """
+    Write the reference matrix as raw .npy arrays (CSC data, indices, indptr and the shape) into the directory
+    dirname, so that load_ref_matrix can memory-map them instead of decompressing an .npz file.
+    :param dirname: output directory
+    :param ref_matrix: sparse matrix with one column per organism and one row per hash
+    :return: None
+    """
+    ref_matrix = sp.sparse.csc_matrix(ref_matrix)
+    # canonical format, so that scipy never needs to sort the (read-only) memory-mapped indices in place
+    ref_matrix.sum_duplicates()
+    os.makedirs(dirname, exist_ok=True)
+    np.save(os.path.join(dirname, 'data.npy'), ref_matrix.data)
+    np.save(os.path.join(dirname, 'indices.npy'), ref_matrix.indices)
+    np.save(os.path.join(dirname, 'indptr.npy'), ref_matrix.indptr)
+    np.save(os.path.join(dirname, 'shape.npy'), np.array(ref_matrix.shape))
+
+
+def load_ref_matrix(dirname):
+    """
+    Helper function that loads the reference matrix written by write_ref_matrix. The arrays are memory-mapped, so
+    only the parts of the matrix that are actually used get read from disk. Training data made by older versions,
+    which stored the matrix as a single .npz file, is still loaded (without memory-mapping).
+    :param dirname: string (location of the reference matrix directory, or of a legacy .npz file)
+    :return: scipy.sparse.csc_matrix (one column per organism and one row per hash)
+    """
+    if os.path.isfile(dirname) and str(dirname).endswith('.npz'):
+        return sp.sparse.csc_matrix(sp.sparse.load_npz(dirname))
+    if not os.path.isdir(dirname):
+        raise ValueError(f'Reference matrix {dirname} is not in the format written by make_training_data_from_sketches.py. '
+                         f'Please re-run make_training_data_from_sketches.py.')
+    data = np.load(os.path.join(dirname, 'data.npy'), mmap_mode='r')
+    indices = np.load(os.path.join(dirname, 'indices.npy'), mmap_mode='r')
+    indptr = np.load(os.path.join(dirname, 'indptr.npy'), mmap_mode='r')
+    shape = tuple(np.load(os.path.join(dirname, 'shape.npy')))
+    return sp.sparse.csc_matrix((data, indices, indptr), shape=shape, copy=False)
 
 
 def write_processed_indices(filename, signatures, uncorr_org_idx):
@@ -214,11 +289,17 @@ def write_processed_indices(filename, signatures, uncorr_org_idx):
     (via get_uncorr_ref)
     :return: None
     """
-    with open(filename, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(['organism_name', 'original_index', 'processed_index', 'num_unique_kmers_in_genome_sketch', 'num_total_kmers_in_genome_sketch', 'genome_scale_factor'])
-        for i, idx in enumerate(tqdm(uncorr_org_idx)):
-            writer.writerow([signatures[idx].name, idx, i, len(signatures[idx].minhash.hashes), get_num_kmers(signatures[idx], scale=False), signatures[idx].minhash.scaled])
+    uncorr_sigs = [signatures[idx] for idx in uncorr_org_idx]
+    # build the manifest column-wise and let pandas write it in one go
+    manifest = pd.DataFrame({
+        'organism_name': [sig.name for sig in uncorr_sigs],
+        'original_index': uncorr_org_idx,
+        'processed_index': np.arange(len(uncorr_org_idx)),
+        'num_unique_kmers_in_genome_sketch': [len(sig.minhash.hashes) for sig in tqdm(uncorr_sigs)],
+        'num_total_kmers_in_genome_sketch': [get_num_kmers(sig, scale=False) for sig in uncorr_sigs],
+        'genome_scale_factor': [sig.minhash.scaled for sig in uncorr_sigs],
+    })
+    manifest.to_csv(filename, index=False, encoding='utf-8')
 
 class Prediction:
     """
@@ -8,7 +8,6 @@ import sys
 # add one level up to the path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
 import srcs.hypothesis_recovery_src as hr
-from scipy.sparse import load_npz
 import argparse
 import srcs.utils as utils
 import warnings
@@ -28,21 +27,8 @@ sample_sketches = os.path.join(data_dir, "sample.sig")
 #############################################################
 # py
 import numpy as np
-import pickle
 import sourmash
 
-
-def load_hashes_to_index(filename):
-    """
-    Helper function that loads the hash_to_col_idx.csv file and returns a dictionary mapping hashes to indices in the
-    training dictionary. filename should point to a CSV file with two columns: hash, col_idx.
-    :param filename: string (location of the hash_to_col_idx.pkl file)
-    :return: dictionary mapping hashes to indicies
-    """
-    with open(filename, mode='rb') as fid:
-        hashes = pickle.load(fid)
-    return hashes
-
 @profile
 def load_signature_with_ksize(filename, ksize):
     """
@@ -93,7 +79,7 @@ def run_YACHT():
     #cmd = f"python {os.path.join(script_dir, 'run_YACHT.py')} --ref_matrix {full_out_prefix}ref_matrix_processed.npz
     # --sample_file " f"{sample_sketches} --outfile {abundance_file} --ksize 31"
     # parse the arguments
-    ref_matrix = f"{full_out_prefix}ref_matrix_processed.npz"
+    ref_matrix = f"{full_out_prefix}ref_matrix_processed"
     sample_file = sample_sketches
     ksize = 31
     ani_thresh = 0.95
@@ -109,8 +95,8 @@ def run_YACHT():
         raise ValueError('min_coverage must be between 0 and 1.')
 
     # Get the training data names
-    prefix = ref_matrix.split('ref_matrix_processed.npz')[0]
-    hash_to_idx_file = prefix + 'hash_to_col_idx.pkl'
+    prefix = ref_matrix.split('ref_matrix_processed')[0]
+    hash_to_idx_file = prefix + 'hash_to_col_idx'
     processed_org_file = prefix + 'processed_org_idx.csv'
 
     # make sure all these files exist
@@ -123,24 +109,15 @@ def run_YACHT():
             f'Processed organism file {processed_org_file} does not exist. Please run ref_matrix.py first.')
 
     # load the training data
-    reference_matrix = load_npz(ref_matrix)
-    hash_to_idx = load_hashes_to_index(hash_to_idx_file)
+    reference_matrix = utils.load_ref_matrix(ref_matrix)
+    hash_keys, hash_idx = utils.load_hash_arrays(hash_to_idx_file)
     organism_data = pd.read_csv(processed_org_file)
 
     # get the sample y vector (indexed by hash/k-mer, with entry = number of times k-mer appears in sample)
     sample_sig = load_signature_with_ksize(sample_file, ksize)
-    # total number of hashes in the training dictionary
-    hash_to_idx_keys = list(hash_to_idx.keys())
-    K = len(hash_to_idx_keys)
-    # initialize the sample vector
-    sample_vector = np.zeros(K)
     # get the hashes in the signature (it's for a single sample)
     sample_hashes = sample_sig.minhash.hashes
-    # get the hashes that are in both the sample and the training dictionary
-    sample_intersect_training_hashes = np.intersect1d(sample_hashes, hash_to_idx_keys, assume_unique=True)
-    for sh in sample_intersect_training_hashes:
-        idx = hash_to_idx[sh]
-        sample_vector[idx] = sample_hashes[sh]
+    sample_vector = utils.compute_sample_vector(sample_hashes, hash_keys, hash_idx)
 
     # get the number of kmers in the sample from the scaled sketch
     sample_scale = sample_sig.minhash.scaled
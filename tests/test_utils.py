@@ -3,10 +3,13 @@ from os.path import exists
 import os
 import numpy as np
 import pandas as pd
+import scipy as sp
+import pytest
 # add the parent directory to the path
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from srcs import utils
+import srcs.hypothesis_recovery_src as hr
 import sourmash
 
 
@@ -24,6 +27,90 @@ def test_load_hashes_to_index():
      assert np.allclose(np.sort(list(hashes.values())), range(0, len(hashes)))
 
 
+def test_compute_sample_vector():
+    hash_to_idx = {2**64 - 1: 0, 17: 2, 5: 1, 123456789: 3}
+    hash_keys, hash_idx = utils.hash_to_idx_arrays(hash_to_idx)
+    assert np.all(np.diff(hash_keys.astype(float)) > 0)
+    # hashes not in the training dictionary (4, 2**63) are ignored
+    sample_hashes = {5: 3, 2**64 - 1: 1, 4: 7, 123456789: 2, 2**63: 5}
+    sample_vector = utils.compute_sample_vector(sample_hashes, hash_keys, hash_idx)
+    assert np.allclose(sample_vector, [1, 3, 0, 2])
+    # empty training dictionary
+    hash_keys, hash_idx = utils.hash_to_idx_arrays({})
+    assert len(utils.compute_sample_vector(sample_hashes, hash_keys, hash_idx)) == 0
+
+
+def test_compute_sample_vector_real_data():
+    hash_to_idx = utils.load_hashes_to_index(to_testing_data("integration_test_hash_to_col_idx.pkl"))
+    sample_hashes = utils.load_signature_with_ksize(to_testing_data("sample.sig"), 31).minhash.hashes
+    hash_keys, hash_idx = utils.hash_to_idx_arrays(hash_to_idx)
+    sample_vector = utils.compute_sample_vector(sample_hashes, hash_keys, hash_idx)
+    # compare with the dictionary based construction
+    expected = np.zeros(len(hash_to_idx))
+    for sh in set(hash_to_idx.keys()).intersection(sample_hashes.keys()):
+        expected[hash_to_idx[sh]] = sample_hashes[sh]
+    assert np.count_nonzero(expected) > 0
+    assert np.array_equal(sample_vector, expected)
+
+
+def test_write_and_load_hash_arrays(tmp_path):
+    hashes = utils.load_hashes_to_index(to_testing_data("integration_test_hash_to_col_idx.pkl"))
+    utils.write_hashes(tmp_path / "hash_to_col_idx", hashes)
+    hash_keys, hash_idx = utils.load_hash_arrays(tmp_path / "hash_to_col_idx")
+    assert len(hash_keys) == len(hashes)
+    assert all(hashes[int(h)] == i for h, i in zip(hash_keys[:100], hash_idx[:100]))
+    # legacy training data pickled the dictionary
+    legacy_keys, legacy_idx = utils.load_hash_arrays(to_testing_data("integration_test_hash_to_col_idx.pkl"))
+    assert np.array_equal(legacy_keys, hash_keys)
+    assert np.array_equal(legacy_idx, hash_idx)
+    # anything else asks to regenerate the training data
+    with pytest.raises(ValueError):
+        utils.load_hash_arrays(to_testing_data("sample.sig"))
+
+
+def test_write_and_load_ref_matrix(tmp_path):
+    ref_matrix = sp.sparse.random(1000, 20, density=0.05, format='csc', random_state=0)
+    ref_matrix = (ref_matrix > 0).astype(np.uint8)
+    utils.write_ref_matrix(tmp_path / "ref_matrix_processed", ref_matrix)
+    loaded = utils.load_ref_matrix(tmp_path / "ref_matrix_processed")
+    assert loaded.format == 'csc'
+    assert loaded.shape == ref_matrix.shape
+    assert loaded.dtype == ref_matrix.dtype
+    assert (loaded != ref_matrix).nnz == 0
+    # the data is a (read-only) view onto the memory-mapped file, not a copy
+    base = loaded.data
+    while not isinstance(base, np.memmap) and isinstance(base, np.ndarray):
+        base = base.base
+    assert isinstance(base, np.memmap)
+    assert not loaded.data.flags.writeable
+    # legacy training data stored the matrix as a single .npz file
+    sp.sparse.save_npz(tmp_path / "ref_matrix_processed.npz", ref_matrix)
+    loaded = utils.load_ref_matrix(str(tmp_path / "ref_matrix_processed.npz"))
+    assert loaded.format == 'csc'
+    assert (loaded != ref_matrix).nnz == 0
+    # anything else asks to regenerate the training data
+    with pytest.raises(ValueError):
+        utils.load_ref_matrix(to_testing_data("sample.sig"))
+
+
+def test_get_uncorr_ref_uint8():
+    reference_sketches = to_testing_data("20_genomes_sketches.zip")
+    signatures = sourmash.load_file_as_signatures(reference_sketches)
+    signature_count = utils.count_files_in_zip(reference_sketches) - 1
+    _, ref_matrix, _, _ = utils.signatures_to_ref_matrix(signatures, 31, signature_count)
+    processed_ref_matrix, uncorr_org_idx = utils.get_uncorr_ref(ref_matrix, 31, 0.95)
+    assert processed_ref_matrix.dtype == np.uint8
+    # hypothesis recovery (in particular the row sums in get_exclusive_indicators) must not depend on the dtype
+    rng = np.random.default_rng(0)
+    sample_vector = np.asarray(processed_ref_matrix[:, :10].sum(axis=1), dtype=float).ravel()
+    sample_vector *= rng.random(len(sample_vector)) < 0.8
+    results_uint8, flags_uint8 = hr.hypothesis_recovery(processed_ref_matrix, sample_vector, 31)
+    results_int64, flags_int64 = hr.hypothesis_recovery(processed_ref_matrix.astype(np.int64), sample_vector, 31)
+    assert np.array_equal(flags_uint8, flags_int64)
+    assert flags_uint8.sum() >= 10
+    pd.testing.assert_frame_equal(results_uint8, results_int64)
+
+
 def test_load_signature_with_ksize1():
     # first, just try a *.sig file
     file = to_testing_data("sample.sig")
@@ -58,7 +145,8 @@ def test_load_signature_with_ksize3():
     # different kind of format
     file = to_testing_data("sample.sig")
     sig = utils.load_signature_with_ksize(file, 31)
-    sourmash.save_signatures([sig], open(to_testing_data('test.sig.zip'), 'wb'), compression=1)
+    with open(to_testing_data('test.sig.zip'), 'wb') as fid:
+        sourmash.save_signatures([sig], fid, compression=1)
     sig = utils.load_signature_with_ksize(to_testing_data('test.sig.zip'), 31)
     assert type(sig) == sourmash.signature.FrozenSourmashSignature
     assert sig.jaccard(sig) == 1.0
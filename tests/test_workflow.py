@@ -1,6 +1,7 @@
 import subprocess
 from os.path import exists
 import os
+import shutil
 import pandas as pd
 
 
@@ -17,12 +18,14 @@ def test_full_workflow():
     abundance_file = full_out_prefix + "recovered_abundance.xlsx"
     reference_sketches = os.path.join(data_dir, "20_genomes_sketches.zip")
     sample_sketches = os.path.join(data_dir, "sample.sig")
-    expected_files = map(lambda x: full_out_prefix + x, ["_hash_to_col_idx.csv", "_processed_org_idx.csv",
-                                              "_ref_matrix_processed.npz", "_ref_matrix_unprocessed.npz",
+    expected_files = map(lambda x: full_out_prefix + x, ["_hash_to_col_idx", "_processed_org_idx.csv",
+                                              "_ref_matrix_processed", "_ref_matrix_unprocessed.npz",
                                               "_recover_abundance.csv", "_ksize_ani_thresh.json"])
     # remove the files if they exist
     for f in expected_files:
-        if exists(f):
+        if os.path.isdir(f):
+            shutil.rmtree(f)
+        elif exists(f):
             os.remove(f)
     cmd = f"python {os.path.join(script_dir, 'make_training_data_from_sketches.py')} --ref_file {reference_sketches}" \
           f" --out_prefix {full_out_prefix} --ksize 31"